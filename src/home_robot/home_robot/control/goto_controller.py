@@ -4,8 +4,10 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 import logging
+import math
 from typing import Optional
 
+import numba
 import numpy as np
 from omegaconf import DictConfig
 
@@ -71,6 +73,38 @@ def xyt_base_to_global(xyt_base2target, xyt_world2base):
     return xyt_world2target
 
 
+@numba.njit(cache=True, fastmath=True)
+def _compute_error_pose_jit(xyt_goal, xyt_loc, track_yaw, xyt_err):
+    """Compiled equivalent of xyt_global_to_base followed by yaw wrapping
+
+    Runs once per control tick, so it is kept free of any Python-level dispatch.
+
+    Args:
+        xyt_goal: SE2 transformation from world to target
+        xyt_loc: SE2 transformation from world to base
+        track_yaw: zero out the yaw error if False, otherwise wrap it to [-pi, pi]
+        xyt_err: preallocated output buffer of shape (3,)
+
+    Returns:
+        xyt_err, filled with the SE2 transformation from base to target
+    """
+    x_diff = xyt_goal[0] - xyt_loc[0]
+    y_diff = xyt_goal[1] - xyt_loc[1]
+    base_cos = math.cos(xyt_loc[2])
+    base_sin = math.sin(xyt_loc[2])
+
+    xyt_err[0] = x_diff * base_cos + y_diff * base_sin
+    xyt_err[1] = x_diff * -base_sin + y_diff * base_cos
+    if track_yaw:
+        theta_diff = xyt_goal[2] - xyt_loc[2]
+        # IEEE-754 remainder (math.remainder is not supported by numba)
+        xyt_err[2] = theta_diff - math.tau * round(theta_diff / math.tau)
+    else:
+        xyt_err[2] = 0.0
+
+    return xyt_err
+
+
 class GotoVelocityController:
     """
     Self-contained controller module for moving a diff drive robot to a target goal.
@@ -88,6 +122,9 @@ class GotoVelocityController:
         self.control = DDVelocityControlNoplan(cfg)
 
         # Initialize
+        # xyt_loc and xyt_goal may be updated from other threads (e.g. ROS callbacks).
+        # They are only ever rebound to fresh arrays and never mutated in place, so a
+        # reader that takes a local reference always sees a consistent pose.
         self.xyt_loc = np.zeros(3)
         self.xyt_goal: Optional[np.ndarray] = None
 
@@ -95,8 +132,13 @@ class GotoVelocityController:
         self.track_yaw = True
         self._is_done = False
 
+        # Preallocated error buffer; the first call triggers (or loads cached) JIT compilation
+        self._xyt_err = np.empty(3)
+        _compute_error_pose_jit(np.zeros(3), np.zeros(3), True, self._xyt_err)
+
     def update_pose_feedback(self, xyt_current: np.ndarray):
-        self.xyt_loc = xyt_current
+        # Copy so that later changes to the caller's array cannot tear the pose
+        self.xyt_loc = np.array(xyt_current, dtype=np.float64)
         self._is_done = False
 
     def update_goal(self, xyt_goal: np.ndarray, relative: bool = False):
@@ -104,7 +146,7 @@ class GotoVelocityController:
         if relative:
             self.xyt_goal = xyt_base_to_global(xyt_goal, self.xyt_loc)
         else:
-            self.xyt_goal = xyt_goal
+            self.xyt_goal = np.array(xyt_goal, dtype=np.float64)
 
     def set_yaw_tracking(self, value: bool):
         self._is_done = False
@@ -113,14 +155,19 @@ class GotoVelocityController:
     def _compute_error_pose(self):
         """
         Updates error based on robot localization
-        """
-        xyt_err = xyt_global_to_base(self.xyt_goal, self.xyt_loc)
-        if not self.track_yaw:
-            xyt_err[2] = 0.0
-        else:
-            xyt_err[2] = (xyt_err[2] + np.pi) % (2 * np.pi) - np.pi
 
-        return xyt_err
+        Only meant to be called from compute_control. The returned array is a buffer
+        owned by the controller and is overwritten in place by the next call, so it is
+        only valid until then; copy it if it needs to be kept.
+        """
+        # Read each pose slot exactly once
+        xyt_goal = self.xyt_goal
+        xyt_loc = self.xyt_loc
+        # The kernel writes in place; it must only ever touch the private error buffer
+        assert self._xyt_err is not xyt_goal and self._xyt_err is not xyt_loc
+        return _compute_error_pose_jit(
+            xyt_goal, xyt_loc, bool(self.track_yaw), self._xyt_err
+        )
 
     def is_done(self) -> bool:
         """Tell us if this is done and has reached its goal."""
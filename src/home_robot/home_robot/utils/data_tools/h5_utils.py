@@ -12,10 +12,13 @@ from home_robot.utils.data_tools.image import img_from_bytes
 
 def view_keyframe_imgs(file_object: h5py.File, trial_name: str):
     """utility to view keyframe images for named trial from h5 file"""
-    num_keyframes = len(file_object[f"{trial_name}/head_rgb"].keys())
+    head_rgb = file_object[f"{trial_name}/head_rgb"]
+    num_keyframes = len(head_rgb)
     for i in range(num_keyframes):
-        _key = f"{trial_name}/head_rgb/{i}"
-        img = img_from_bytes(file_object[_key][()])
+        if isinstance(head_rgb, h5py.Dataset):
+            img = head_rgb[i]
+        else:
+            img = img_from_bytes(head_rgb[str(i)][()])
         plt.imshow(img)
         plt.show()
 
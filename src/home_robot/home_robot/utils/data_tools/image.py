@@ -3,6 +3,8 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 import io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import h5py
@@ -53,6 +55,17 @@ def png_to_gif(
     gif = []
     print("Writing gif to file:", name)
     img_stream = group[key]
+    if isinstance(img_stream, h5py.Dataset):
+        # Raw frames (see DataWriter raw_images), stacked in a single dataset
+        for img in tqdm(img_stream, ncols=50):
+            if height and width:
+                img = np.asarray(Image.fromarray(img).resize([width, height]))
+            gif.append(img)
+        if save:
+            imageio.mimsave(name, gif)
+            return
+        else:
+            return gif
     # for i,aimg in enumerate(tqdm(group[key], ncols=50)):
     for ki, k in tqdm(
         sorted([(int(j), j) for j in img_stream.keys()], key=lambda pair: pair[0]),
@@ -104,32 +117,50 @@ def schema_to_gifs(filename: str):
         optimize(gif_name)
 
 
-def png_to_mp4(group: h5py.Group, key: str, name: str, fps=10):
+def _decode_bgr(bindata: bytes) -> np.ndarray:
+    """Decode png bytes straight to BGR, the channel order cv2.VideoWriter expects"""
+    return cv2.imdecode(np.frombuffer(bindata, np.uint8), cv2.IMREAD_COLOR)
+
+
+def png_to_mp4(group: h5py.Group, key: str, name: str, fps=10, prefetch=8):
     """
     Write key out as a mpt
+
+    Raw frames (see DataWriter raw_images) are streamed straight from their dataset.
+    Png frames are read from the h5 file on this thread and decoded on a small thread
+    pool, up to `prefetch` frames ahead of the video writer.
     """
     print("Writing gif to file:", name)
     img_stream = group[key]
     writer = None
 
-    # for i,aimg in enumerate(tqdm(group[key], ncols=50)):
-    for ki, k in tqdm(
-        sorted([(int(j), j) for j in img_stream.keys()], key=lambda pair: pair[0]),
-        ncols=50,
-    ):
-
-        bindata = img_stream[k][()]
-        _img = img_from_bytes(bindata)
-        w, h = _img.shape[:2]
-        img = np.zeros_like(_img)
-        img[:, :, 0] = _img[:, :, 2]
-        img[:, :, 1] = _img[:, :, 1]
-        img[:, :, 2] = _img[:, :, 0]
-
+    def write(img):
+        nonlocal writer
         if writer is None:
+            height, width = img.shape[:2]
             fourcc = cv2.VideoWriter_fourcc("m", "p", "4", "v")
-            writer = cv2.VideoWriter(name, fourcc, fps, (h, w))
+            writer = cv2.VideoWriter(name, fourcc, fps, (width, height))
         writer.write(img)
+
+    if isinstance(img_stream, h5py.Dataset):
+        # Raw frames are RGB; convert each into one reused BGR buffer
+        out_buf = np.empty(img_stream.shape[1:], dtype=img_stream.dtype)
+        for img in tqdm(img_stream, ncols=50):
+            cv2.cvtColor(img, cv2.COLOR_RGB2BGR, dst=out_buf)
+            write(out_buf)
+        writer.release()
+        return
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # Frames are stored one dataset per index; sort the names numerically once
+        for k in tqdm(sorted(img_stream, key=int), ncols=50):
+            bindata = img_stream[k][()]
+            pending.append(executor.submit(_decode_bgr, bindata))
+            if len(pending) >= prefetch:
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
     writer.release()
 
 
@@ -67,7 +67,11 @@ class Trial(object):
     def get_img(self, key, idx, depth=False, rgb=False, depth_factor=10000):
         assert key in self.image_keys
         group = self[key]
-        arr = image.img_from_bytes(group[str(idx)][()])
+        if isinstance(group, h5py.Dataset):
+            # Raw frames, stacked in a single dataset
+            arr = group[idx]
+        else:
+            arr = image.img_from_bytes(group[str(idx)][()])
         if depth:
             return arr / depth_factor
         elif rgb:
@@ -11,6 +11,9 @@ import numpy as np
 import home_robot.utils.data_tools.base as base
 import home_robot.utils.data_tools.image as image
 
+# Group that raw_images trials stream into until write_trial gives them their name
+STREAM_GROUP = "trial_in_progress_"
+
 
 class DataWriter(object):
     """This class contains tools to write out data into an hdf5 file containing many different
@@ -21,11 +24,18 @@ class DataWriter(object):
     observation, action spaces, among other things.
     """
 
-    def __init__(self, filename="data.h5", dirname=None):
+    def __init__(self, filename="data.h5", dirname=None, raw_images=False):
         """
         Optionally initialize with a directory.
+
+        If raw_images is set, image frames are stored as raw arrays in one chunked,
+        lzf-compressed dataset per key instead of one png-encoded dataset per frame.
+        Encoding png is much slower than lzf, so this is better suited to recording.
+        Image and temporal frames are then appended to the file as they are added,
+        instead of being held in memory until write_trial.
         """
         self.filename = filename
+        self.raw_images = raw_images
         self.dirname = dirname
         if dirname is not None:
             try:
@@ -36,6 +46,8 @@ class DataWriter(object):
         else:
             self.filename = self.filename
         self.num_trials = 0
+        self._h5_file = None
+        self._stream_group = None
         self.reset()
 
     def reset(self):
@@ -55,6 +67,12 @@ class DataWriter(object):
                 raise RuntimeError(
                     "duplicate key: " + str(k) + " was in temporal data already."
                 )
+        if self.raw_images:
+            self._check_stream_shapes(self.img_data, data)
+        for k, v in data.items():
+            if self.raw_images:
+                self._append_to_stream(self.img_data, k, v, image=True)
+                continue
             if k not in self.img_data:
                 self.img_data[k] = []
             data = image.img_to_bytes(v)
@@ -73,11 +91,89 @@ class DataWriter(object):
                 raise RuntimeError(
                     "duplicate key: " + str(k) + " was in image data already."
                 )
+        if self.raw_images:
+            self._check_stream_shapes(self.temporal_data, data)
+        for k, v in data.items():
+            if self.raw_images:
+                self._append_to_stream(self.temporal_data, k, v)
+                continue
             if k not in self.temporal_data:
                 self.temporal_data[k] = []
             self.temporal_data[k].append(v)
         return True
 
+    def add_synced_frame(self, img_data: Dict[str, Any], data: Dict[str, Any]):
+        """Add an image frame and its temporal data together. If either part fails,
+        neither is kept, so image and temporal data stay the same length."""
+        lengths = [
+            {k: len(v) for k, v in frames.items()}
+            for frames in (self.img_data, self.temporal_data)
+        ]
+        try:
+            self.add_img_frame(**img_data)
+            self.add_frame(**data)
+        except Exception:
+            for frames, counts in zip((self.img_data, self.temporal_data), lengths):
+                self._truncate(frames, counts)
+            raise
+        return True
+
+    def _truncate(self, frames: Dict[str, Any], counts: Dict[str, int]):
+        """Drop frames added past counts, and keys that were not there at all"""
+        for k in list(frames.keys()):
+            if k not in counts:
+                if isinstance(frames[k], h5py.Dataset):
+                    del self._stream_group[k]
+                del frames[k]
+            elif isinstance(frames[k], h5py.Dataset):
+                frames[k].resize(counts[k], axis=0)
+            else:
+                del frames[k][counts[k] :]
+
+    def _get_stream_group(self) -> h5py.Group:
+        """Open the file and the in-progress trial group that frames stream into"""
+        if self._stream_group is None:
+            self._h5_file = h5py.File(self.filename, "a")
+            if STREAM_GROUP in self._h5_file:
+                # Left over from a recording that never finished
+                del self._h5_file[STREAM_GROUP]
+            self._stream_group = self._h5_file.create_group(STREAM_GROUP)
+        return self._stream_group
+
+    def _check_stream_shapes(self, datasets: Dict[str, Any], data: Dict[str, Any]):
+        """Validate a frame against the streamed datasets before anything is written"""
+        for k, v in data.items():
+            if k[-1] == "_":
+                raise RuntimeError(
+                    "invalid name for dataset key: "
+                    + str(k)
+                    + " cannot end with _; this is reserved."
+                )
+            if k in datasets and datasets[k].shape[1:] != np.shape(v):
+                raise RuntimeError(
+                    "shape mismatch for key: "
+                    + str(k)
+                    + f" expected {datasets[k].shape[1:]}, got {np.shape(v)}."
+                )
+
+    def _append_to_stream(self, datasets: Dict[str, Any], k: str, v, image=False):
+        """Append one frame to a resizable dataset in the in-progress trial group"""
+        v = np.asarray(v)
+        if k not in datasets:
+            datasets[k] = self._get_stream_group().create_dataset(
+                k,
+                shape=(0,) + v.shape,
+                maxshape=(None,) + v.shape,
+                dtype=v.dtype,
+                # One chunk per image, so each frame is compressed as it arrives
+                chunks=(1,) + v.shape if image else True,
+                compression="lzf",
+            )
+        dset = datasets[k]
+        n = dset.shape[0]
+        dset.resize(n + 1, axis=0)
+        dset[n] = v
+
     def fix_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Flatten dictionaries"""
         new_data = {}
@@ -126,6 +222,39 @@ class DataWriter(object):
             self.config_data[k] = v
         return True
 
+    def _write_trial_data(self, trial: h5py.Group):
+        """Write everything not streamed yet, plus the key lists, into the trial group"""
+        # Now write the example out here
+        temporal_keys = ",".join(list(self.temporal_data.keys()))
+        img_keys = ",".join(list(self.img_data.keys()))
+        config_keys = ",".join(list(self.config_data.keys()))
+        data = {} if self.raw_images else self.temporal_data
+        data.update(self.config_data)
+        for k, v in data.items():
+            # Add this to the hdf5 file
+            if k[-1] == "_":
+                raise RuntimeError(
+                    "invalid name for dataset key: "
+                    + str(k)
+                    + " cannot end with _; this is reserved."
+                )
+            try:
+                trial[k] = v
+            except TypeError as e:
+                print(e)
+                print("Cannot use type: ", k)
+                import pdb
+
+                pdb.set_trace()
+        if not self.raw_images:
+            for k, v in self.img_data.items():
+                for i, bindata in enumerate(v):
+                    ki = os.path.join(k, str(i))
+                    trial[ki] = np.void(bindata)
+        trial[base.TEMPORAL_KEYS] = temporal_keys
+        trial[base.CONFIG_KEYS] = config_keys
+        trial[base.IMAGE_KEYS] = img_keys
+
     def write_trial(self, trial_id=None):
         """
         Finish adding data and write to hdf5 archive
@@ -135,38 +264,19 @@ class DataWriter(object):
         else:
             trial_id = str(trial_id)
         self.num_trials += 1
-        with h5py.File(self.filename, "a") as h5_file:
-            trial = h5_file.create_group(trial_id)
-
-            # Now write the example out here
-            temporal_keys = ",".join(list(self.temporal_data.keys()))
-            img_keys = ",".join(list(self.img_data.keys()))
-            config_keys = ",".join(list(self.config_data.keys()))
-            data = self.temporal_data
-            data.update(self.config_data)
-            for k, v in data.items():
-                # Add this to the hdf5 file
-                if k[-1] == "_":
-                    raise RuntimeError(
-                        "invalid name for dataset key: "
-                        + str(k)
-                        + " cannot end with _; this is reserved."
-                    )
-                try:
-                    trial[k] = v
-                except TypeError as e:
-                    print(e)
-                    print("Cannot use type: ", k)
-                    import pdb
-
-                    pdb.set_trace()
-            for k, v in self.img_data.items():
-                for i, bindata in enumerate(v):
-                    ki = os.path.join(k, str(i))
-                    trial[ki] = np.void(bindata)
-            trial[base.TEMPORAL_KEYS] = temporal_keys
-            trial[base.CONFIG_KEYS] = config_keys
-            trial[base.IMAGE_KEYS] = img_keys
+        if self.raw_images:
+            # Frames are already on disk; give the in-progress group its final name
+            self._get_stream_group()
+            self._h5_file.move(STREAM_GROUP, trial_id)
+            try:
+                self._write_trial_data(self._h5_file[trial_id])
+            finally:
+                self._h5_file.close()
+                self._h5_file = None
+                self._stream_group = None
+        else:
+            with h5py.File(self.filename, "a") as h5_file:
+                self._write_trial_data(h5_file.create_group(trial_id))
 
         # At the end, clear current stored data + configs
         self.reset()
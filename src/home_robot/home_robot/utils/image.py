@@ -68,17 +68,24 @@ class Camera(object):
     def get_pose(self):
         return self.pose_matrix.copy()
 
+    def get_unprojection_rays(self):
+        """get a height x width x 3 table of per-pixel ray directions with unit z, so that
+        xyz = depth * rays. Cached until the intrinsics change."""
+        key = (self.height, self.width, self.px, self.py, self.fx, self.fy)
+        if getattr(self, "_rays_key", None) != key:
+            indices = np.indices((self.height, self.width), dtype=np.float32)
+            rays = np.ones((self.height, self.width, 3), dtype=np.float32)
+            # pixel indices start at top-left corner. for these equations, it starts at bottom-left
+            rays[:, :, 0] = (indices[1] - self.px) / self.fx
+            rays[:, :, 1] = (indices[0] - self.py) / self.fy
+            self._rays = rays
+            self._rays_key = key
+        return self._rays
+
     def depth_to_xyz(self, depth):
         """get depth from numpy using simple pinhole self model"""
-        indices = np.indices((self.height, self.width), dtype=np.float32).transpose(
-            1, 2, 0
-        )
-        z = depth
-        # pixel indices start at top-left corner. for these equations, it starts at bottom-left
-        x = (indices[:, :, 1] - self.px) * (z / self.fx)
-        y = (indices[:, :, 0] - self.py) * (z / self.fy)
         # Should now be height x width x 3, after this:
-        xyz = np.stack([x, y, z], axis=-1)
+        xyz = depth[:, :, None] * self.get_unprojection_rays()
         return xyz
 
     def fix_depth(self, depth):
@@ -4,12 +4,12 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 import logging
+import math
 import threading
 from typing import List, Optional
 
 import numpy as np
 import rospy
-import sophus as sp
 from geometry_msgs.msg import Pose, PoseStamped, Twist
 from nav_msgs.msg import Odometry
 from std_msgs.msg import Bool
@@ -23,8 +23,7 @@ from std_srvs.srv import (
 
 from home_robot.control.goto_controller import GotoVelocityController
 from home_robot.utils.config import get_control_config
-from home_robot.utils.geometry import sophus2xyt, xyt2sophus, xyt_global_to_base
-from home_robot_hw.ros.utils import matrix_from_pose_msg
+from home_robot.utils.geometry import xyt2sophus
 from home_robot_hw.ros.visualizer import Visualizer
 
 log = logging.getLogger(__name__)
@@ -32,6 +31,15 @@ log = logging.getLogger(__name__)
 CONTROL_HZ = 20
 VEL_THRESHOlD = 0.001
 RVEL_THRESHOLD = 0.005
+SUB_BUFF_SIZE = 2**20
+GOAL_VIS_HZ = 5
+
+
+def _pose_msg_to_xyt(msg: Pose) -> np.ndarray:
+    """Reads planar (x, y, yaw) directly from a pose message, skipping any SE3 round-trip"""
+    q = msg.orientation
+    yaw = math.atan2(2.0 * (q.w * q.z + q.x * q.y), 1.0 - 2.0 * (q.y * q.y + q.z * q.z))
+    return np.array([msg.position.x, msg.position.y, yaw])
 
 
 class GotoVelocityControllerNode:
@@ -66,53 +74,85 @@ class GotoVelocityControllerNode:
         self.controller_finished = True
         self.done_since = rospy.Time(0)
         self.track_yaw = True
+        self._cmd = Twist()
+
+        # Latest messages received by the subscribers. Callbacks only rebind these slots
+        # (atomic under the GIL); all processing happens in the control loop.
+        self._latest_pose_msg: Optional[PoseStamped] = None
+        self._latest_odom_msg: Optional[Odometry] = None
+        self._latest_goal_msg: Optional[Pose] = None
+        self._last_pose_msg: Optional[PoseStamped] = None
+        self._last_odom_msg: Optional[Odometry] = None
+        self._last_goal_msg: Optional[Pose] = None
 
         # Visualizations
         self.goal_visualizer = Visualizer("goto_controller/goal_abs")
+        self._goal_vis_pending = False
 
     def _pose_update_callback(self, msg: PoseStamped):
-        pose_sp = sp.SE3(matrix_from_pose_msg(msg.pose))
-        self.xyt_filtered = sophus2xyt(pose_sp)
-        if not self.odom_only:
-            self.controller.update_pose_feedback(self.xyt_filtered)
+        self._latest_pose_msg = msg
 
     def _odom_update_callback(self, msg: Odometry):
-        pose_sp = sp.SE3(matrix_from_pose_msg(msg.pose.pose))
-        self.vel_odom = np.array([msg.twist.twist.linear.x, msg.twist.twist.angular.z])
-        if self.odom_only:
-            self.controller.update_pose_feedback(sophus2xyt(pose_sp))
+        self._latest_odom_msg = msg
 
     def _goal_update_callback(self, msg: Pose):
-        pose_sp = sp.SE3(matrix_from_pose_msg(msg))
+        self._latest_goal_msg = msg
 
-        """
+    def _process_pose_msg(self, msg: PoseStamped):
+        self.xyt_filtered = _pose_msg_to_xyt(msg.pose)
+        if not self.odom_only:
+            self.controller.update_pose_feedback(self.xyt_filtered)
+
+    def _process_odom_msg(self, msg: Odometry):
+        self.vel_odom = np.array([msg.twist.twist.linear.x, msg.twist.twist.angular.z])
         if self.odom_only:
-            # Project absolute goal from current odometry reading
-            pose_delta = xyt2sophus(self.xyt_loc_odom).inverse() * pose_sp
-            pose_goal = xyt2sophus(self.xyt_loc_odom) * pose_delta
-        else:
-            # Assign absolute goal directly
-            pose_goal = pose_sp
-        """
+            self.controller.update_pose_feedback(_pose_msg_to_xyt(msg.pose.pose))
 
+    def _process_goal_msg(self, msg: Pose):
         if self.active:
-            pose_goal = pose_sp
-
-            self.controller.update_goal(sophus2xyt(pose_goal))
+            self.controller.update_goal(_pose_msg_to_xyt(msg))
             self.xyt_goal = self.controller.xyt_goal
 
             self.is_done = False
             self.controller_finished = False
 
-            # Visualize
-            self.goal_visualizer(pose_goal.matrix())
+            # Visualize (published from a timer, out of the control loop)
+            self._goal_vis_pending = True
 
         # Do not update goal if controller is not active (prevents _enable_service to suddenly start moving the robot)
         else:
             log.warn("Received a goal while NOT active. Goal is not updated.")
 
+    def _process_latest_msgs(self):
+        """Snapshots the subscriber slots and processes any message not seen yet"""
+        pose_msg = self._latest_pose_msg
+        if pose_msg is not None and pose_msg is not self._last_pose_msg:
+            self._last_pose_msg = pose_msg
+            self._process_pose_msg(pose_msg)
+
+        odom_msg = self._latest_odom_msg
+        if odom_msg is not None and odom_msg is not self._last_odom_msg:
+            self._last_odom_msg = odom_msg
+            self._process_odom_msg(odom_msg)
+
+        goal_msg = self._latest_goal_msg
+        if goal_msg is not None and goal_msg is not self._last_goal_msg:
+            self._last_goal_msg = goal_msg
+            self._process_goal_msg(goal_msg)
+
+    def _visualize_goal(self, event):
+        """Publishes the most recent goal. Poses stay planar everywhere else; this is the
+        only place they are converted to SE3, at most GOAL_VIS_HZ times per second."""
+        xyt_goal = self.xyt_goal
+        if not self._goal_vis_pending or xyt_goal is None:
+            return
+        self._goal_vis_pending = False
+        self.goal_visualizer(xyt2sophus(xyt_goal).matrix())
+
     def _enable_service(self, request: TriggerRequest) -> TriggerResponse:
         """activates the controller and acks activation request"""
+        # Discard goals received while inactive that the control loop has not seen yet
+        self._last_goal_msg = self._latest_goal_msg
         self.xyt_goal = None
         self.active = True
         return TriggerResponse(
@@ -141,15 +181,18 @@ class GotoVelocityControllerNode:
         )
 
     def _set_velocity(self, v_m, w_r):
-        cmd = Twist()
-        cmd.linear.x = v_m
-        cmd.angular.z = w_r
-        self.vel_command_pub.publish(cmd)
+        # Publisher serializes on publish, so the cached message can be mutated safely
+        self._cmd.linear.x = v_m
+        self._cmd.angular.z = w_r
+        self.vel_command_pub.publish(self._cmd)
 
     def _run_control_loop(self):
-        rate = rospy.Rate(self.hz)
+        period = 1.0 / self.hz
+        next_t = rospy.get_time()
 
         while not rospy.is_shutdown():
+            self._process_latest_msgs()
+
             if self.active and self.xyt_goal is not None:
                 # Compute control
                 self.is_done = False
@@ -178,8 +221,14 @@ class GotoVelocityControllerNode:
                 self._set_velocity(v_cmd, w_cmd)
                 self.at_goal_pub.publish(self.is_done)
 
-            # Spin
-            rate.sleep()
+            # Spin until the next absolute deadline. Unlike rospy.Rate, a late tick
+            # resets the schedule instead of firing the missed ticks back-to-back.
+            next_t += period
+            now = rospy.get_time()
+            if next_t < now:
+                next_t = now
+            else:
+                rospy.sleep(next_t - now)
 
     def main(self):
         # ROS comms
@@ -190,20 +239,33 @@ class GotoVelocityControllerNode:
             "goto_controller/at_goal", Bool, queue_size=1
         )
 
+        # With queue_size=1, rospy only drops stale messages if the socket buffer is
+        # large enough to hold them (buff_size > queue_size * msg size); otherwise old
+        # messages pile up in the OS buffer and latency grows over time.
+        # tcp_nodelay disables Nagle's algorithm so small messages are sent immediately.
         rospy.Subscriber(
             "state_estimator/pose_filtered",
             PoseStamped,
             self._pose_update_callback,
             queue_size=1,
+            buff_size=SUB_BUFF_SIZE,
+            tcp_nodelay=True,
         )
         rospy.Subscriber(
             "odom",
             Odometry,
             self._odom_update_callback,
             queue_size=1,
+            buff_size=SUB_BUFF_SIZE,
+            tcp_nodelay=True,
         )
         rospy.Subscriber(
-            "goto_controller/goal", Pose, self._goal_update_callback, queue_size=1
+            "goto_controller/goal",
+            Pose,
+            self._goal_update_callback,
+            queue_size=1,
+            buff_size=SUB_BUFF_SIZE,
+            tcp_nodelay=True,
         )
 
         rospy.Service("goto_controller/enable", Trigger, self._enable_service)
@@ -212,6 +274,8 @@ class GotoVelocityControllerNode:
             "goto_controller/set_yaw_tracking", SetBool, self._set_yaw_tracking_service
         )
 
+        rospy.Timer(rospy.Duration(1.0 / GOAL_VIS_HZ), self._visualize_goal)
+
         # Run controller
         log.info("Goto Controller launched.")
         self._run_control_loop()
@@ -3,19 +3,31 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 import argparse
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 
-import cv2
-import h5py
+import numba
 import numpy as np
 import rospy
-from tqdm import tqdm
 
-from home_robot.utils.data_tools.image import img_from_bytes
+from home_robot.utils.data_tools.image import png_to_mp4, pngs_to_mp4
 from home_robot.utils.data_tools.writer import DataWriter
 from home_robot.utils.pose import to_pos_quat
 from home_robot_hw.env.stretch_manipulation_env import StretchManipulationEnv
 
 
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def _scale_depth(depth, scale, out):
+    """Writes depth * scale into the uint16 array out, without a float temporary"""
+    d = depth.reshape(-1)
+    o = out.reshape(-1)
+    for i in numba.prange(d.size):
+        o[i] = np.uint16(d[i] * scale)
+    return out
+
+
 class Recorder(object):
     """ROS object that subscribes from information from the robot and publishes it out."""
 
@@ -26,10 +38,18 @@ class Recorder(object):
         print("... done connecting to robot environment")
         self.rgb_cam = self.robot.rgb_cam
         self.dpt_cam = self.robot.dpt_cam
-        self.writer = DataWriter(filename)
+        self.writer = DataWriter(filename, raw_images=True)
         self.idx = 0
         self._recording_started = start_recording
         self._filename = filename
+        _scale_depth(np.zeros((1, 1)), np.float64(10000), np.empty((1, 1), np.uint16))
+        # Runs the slow per-frame queries (camera + xyz, TF lookup) concurrently
+        self._executor = ThreadPoolExecutor(max_workers=2)
+        # All file I/O happens on a background thread so that slow writes never block
+        # acquisition; when the queue is full, new frames are dropped
+        self._frame_queue = queue.Queue(maxsize=64)
+        self._writer_thread = threading.Thread(target=self._write_frames, daemon=True)
+        self._writer_thread.start()
 
     def start_recording(self, task_name):
         self._recording_started = True
@@ -45,8 +65,18 @@ class Recorder(object):
         print(f"Ready to record demonstration to file: {self._filename}")
 
     def finish_recording(self):
+        write_trial = partial(self.writer.write_trial, self.idx)
+        if self._writer_thread.is_alive():
+            # Queued behind the pending frames; wait for the trial to be on disk
+            done = Future()
+            self._frame_queue.put((write_trial, done))
+            done.result()
+        else:
+            print(
+                "Warning: recorder writer thread is not running; queued frames are lost."
+            )
+            write_trial()
         print(f"... done recording trial named: {self.idx}.")
-        self.writer.write_trial(self.idx)
         self.idx += 1
 
     def _construct_camera_info(self, camera):
@@ -69,29 +99,35 @@ class Recorder(object):
         7. camera info
         8. end-effector pose
         """
-        # record rgb and depth
-        rgb, depth, xyz = self.robot.get_images(compute_xyz=True)
-        q, dq = self.robot.update()
+        # record rgb and depth; the image fetch and TF lookup are independent and can
+        # block, so run them in the background while reading the cached robot state
+        images_future = self._executor.submit(self.robot.get_images, compute_xyz=True)
         # TODO get the following from TF lookup
         # ee_pose = self.robot.model.manip_fk(q)
-        ee_pose = self.robot.get_pose("link_straight_gripper", "base_link")
-        # output of above is a tuple of two ndarrays
-        # ee-pose should be 1 ndarray of 7 values
-        ee_pose = to_pos_quat(ee_pose)
-        ee_pose = np.concatenate(ee_pose)
+        ee_pose_future = self._executor.submit(
+            self.robot.get_pose, "link_straight_gripper", "base_link"
+        )
+        q, dq = self.robot.update()
         gripper_state = np.array(self.robot.get_gripper_state(q))
         # elements in following are of type: Tuple(Tuple(x,y,theta), rospy.Time)
         # change to ndarray with 4 floats
         base_pose = self.robot.get_base_pose()
         camera_pose = self.robot.get_camera_pose_matrix()
+        # output of above is a tuple of two ndarrays
+        # ee-pose should be 1 ndarray of 7 values
+        ee_pose = to_pos_quat(ee_pose_future.result())
+        ee_pose = np.concatenate(ee_pose)
+        rgb, depth, xyz = images_future.result()
         if is_keyframe:
             user_keyframe = np.array([1])
         else:
             user_keyframe = np.array([0])
-        self.writer.add_img_frame(
-            head_rgb=rgb, head_depth=(depth * 10000).astype(np.uint16)
-        )
-        self.writer.add_frame(
+        depth = np.ascontiguousarray(depth)
+        # Queued frames are written later, so each frame needs its own depth array
+        depth_u16 = np.empty(depth.shape, np.uint16)
+        _scale_depth(depth, depth.dtype.type(10000), depth_u16)
+        img_frame = dict(head_rgb=rgb, head_depth=depth_u16)
+        frame = dict(
             q=q,
             dq=dq,
             ee_pose=ee_pose,
@@ -101,59 +137,57 @@ class Recorder(object):
             user_keyframe=user_keyframe,
             head_xyz=xyz,
         )
+        try:
+            self._frame_queue.put_nowait(
+                (partial(self.writer.add_synced_frame, img_frame, frame), None)
+            )
+        except queue.Full:
+            print("Warning: recorder write queue is full, dropping frame.")
 
         return rgb, depth, q, dq
 
-    def spin(self, rate=10):
-        rate = rospy.Rate(rate)
-        while not rospy.is_shutdown():
-            if not self._recording_started:
-                print("...")
-                rate.sleep()
-                continue
+    def _write_frames(self):
+        """Background thread: runs queued data writer calls in order"""
+        while True:
+            write, done = self._frame_queue.get()
+            try:
+                result = write()
+            except Exception as e:
+                # Keep draining; a dead writer thread would block finish_recording
+                if done is None:
+                    print(f"Warning: failed to write recorded frame: {e}")
+                else:
+                    done.set_exception(e)
+            else:
+                if done is not None:
+                    done.set_result(result)
+            finally:
+                self._frame_queue.task_done()
+
+    def _on_tick(self, event: rospy.timer.TimerEvent):
+        # rospy.Timer fires the ticks a slow save_frame overran back to back to catch
+        # up; skip those so frames stay evenly spaced instead of bunching together
+        if (event.current_real - event.current_expected).to_sec() > self._tick_period:
+            return
+        if self._recording_started:
             self.save_frame()
-            rate.sleep()
+
+    def spin(self, rate=10):
+        self._tick_period = 1.0 / rate
+        timer = rospy.Timer(rospy.Duration(self._tick_period), self._on_tick)
+        rospy.spin()
+        # shutdown() does not wait for an in-flight save_frame; join the timer thread so
+        # no frame is queued while the trial is being written
+        timer.shutdown()
+        timer.join()
         self.finish_recording()
 
     def close(self):
         """clean-up: delete self"""
+        self._executor.shutdown()
         del self
 
 
-def png_to_mp4(group: h5py.Group, key: str, name: str, fps=10):
-    """
-    Write key out as a gif
-    """
-    print("Writing gif to file:", name)
-    img_stream = group[key]
-    writer = None
-
-    # for i,aimg in enumerate(tqdm(group[key], ncols=50)):
-    for ki, k in tqdm(
-        sorted([(int(j), j) for j in img_stream.keys()], key=lambda pair: pair[0]),
-        ncols=50,
-    ):
-        bindata = img_stream[k][()]
-        _img = img_from_bytes(bindata)
-        w, h = _img.shape[:2]
-        img = np.zeros_like(_img)
-        img[:, :, 0] = _img[:, :, 2]
-        img[:, :, 1] = _img[:, :, 1]
-        img[:, :, 2] = _img[:, :, 0]
-
-        if writer is None:
-            fourcc = cv2.VideoWriter_fourcc("m", "p", "4", "v")
-            writer = cv2.VideoWriter(name, fourcc, fps, (h, w))
-        writer.write(img)
-    writer.release()
-
-
-def pngs_to_mp4(filename: str, key: str, vid_name: str, fps: int):
-    h5 = h5py.File(filename, "r")
-    for group_name, group in h5.items():
-        png_to_mp4(group, key, str(vid_name) + "_" + group_name + ".mp4", fps=fps)
-
-
 def parse_args():
     parser = argparse.ArgumentParser("data recorder v1")
     parser.add_argument("--filename", "-f", default="test-data.h5")
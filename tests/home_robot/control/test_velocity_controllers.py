@@ -46,3 +46,27 @@ def test_controller_input_output(controller, dataset):
     for x, y_ref in dataset:
         y = get_controller_output(controller, x)
         assert np.allclose(y, y_ref)
+
+
+# Expected outputs below are worked out by hand from the gains in
+# config/control/noplan_velocity_sim.yaml (v_max=0.3, w_max=0.45, acc_lin=0.2,
+# acc_ang=0.6, lin_error_tol=0.01, ang_error_tol=0.025, max_heading_ang=0.7854)
+@pytest.mark.parametrize(
+    "xyt_err, v_ref, w_ref, done_ref",
+    [
+        # Goal straight ahead: full linear speed, no turning
+        ((2.0, 0.0, 0.0), 0.3, 0.0, False),
+        # Goal heading pi/2 is past max_heading_ang: turn in place at w_max
+        ((0.0, 1.0, 0.0), 0.0, 0.45, False),
+        ((0.0, -1.0, 0.0), 0.0, -0.45, False),
+        # At goal XY: rotate only, w = sqrt(2 * 0.075 * 0.6) = 0.3
+        ((0.005, 0.0, -0.075), 0.0, -0.3, False),
+        # Within both tolerances
+        ((0.005, -0.005, 0.02), 0.0, 0.0, True),
+    ],
+)
+def test_control_step(controller, xyt_err, v_ref, w_ref, done_ref):
+    v_cmd, w_cmd, done = controller.control(np.array(xyt_err))
+    assert v_cmd == pytest.approx(v_ref)
+    assert w_cmd == pytest.approx(w_ref)
+    assert done == done_ref